@@ -7,20 +7,26 @@ import logging
 import html
 import string
 import random
+import re
+import atexit
+import gzip
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
-from email.mime.application import MIMEApplication
-from email.mime.base import MIMEBase
-from email import encoders
+from email.message import EmailMessage, MIMEPart
+from email import policy
 from flask import Flask, render_template, request, flash, redirect, url_for, jsonify, session
+from jinja2 import FileSystemBytecodeCache
 from werkzeug.utils import secure_filename
 from werkzeug.security import generate_password_hash, check_password_hash
-from threading import Thread
+from threading import Thread, Lock, BoundedSemaphore
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from queue import Queue, Full, Empty
 from datetime import datetime, date, timedelta
 from dotenv import load_dotenv
 from openpyxl import load_workbook
-from contextlib import contextmanager
-from functools import wraps
+from contextlib import contextmanager, closing
+from functools import wraps, lru_cache
+from itertools import islice
 import psycopg
 from psycopg.rows import dict_row
 from psycopg_pool import ConnectionPool
@@ -40,11 +46,30 @@ ALLOWED_ATTACHMENT_EXTENSIONS = {'pdf', 'doc', 'docx', 'txt', 'jpg', 'jpeg', 'pn
 MAX_CONTENT_LENGTH = 50 * 1024 * 1024  # 50MB max file size
 LOGS_FOLDER = 'logs'
 EMAIL_LIMIT_PER_ACCOUNT = 15  # Limit per account
+SMTP_SERVER = 'smtp.gmail.com'  # Sender accounts are Gmail / Google Workspace accounts
+SMTP_PORT = 587  # STARTTLS submission port
+SMTP_NOOP_INTERVAL = 20  # Health-check persistent SMTP connections every N messages
+SMTP_THROTTLE_SECONDS = 60  # How long a sender stays at half rate after a 4xx throttle reply
+SMTP_RECONNECT_ATTEMPTS = 4  # Reconnect attempts, with exponential backoff, after a dropped connection
+DEFAULT_SMTP_CONCURRENCY = 5  # Sender accounts sending at once in auto-rotate mode
+MAX_SMTP_CONCURRENCY = 15  # Gmail allows at most 15 concurrent SMTP connections
+EMAIL_CONTENT_TYPES = ('both', 'html', 'plain')  # Body parts to send; 'both' is multipart/alternative
+FAILED_EMAILS_PREVIEW_LIMIT = 50  # Failed emails kept in memory for the status page
+SEND_QUEUE_SIZE = 500  # Max rows buffered between the file reader and the sender workers
+STATUS_PUBLISH_INTERVAL = 10  # Sends a worker aggregates locally before updating the shared status
+STATUS_PUBLISH_SECONDS = 2  # ...or seconds, matching the status page poll interval
+CAMPAIGN_WORKERS = int(os.getenv('EMAIL_WORKERS', 4))  # Campaigns sending at the same time
+MAX_PENDING_CAMPAIGNS = CAMPAIGN_WORKERS * 2  # Running plus queued campaigns before new ones are refused
+ACCOUNT_STATS_TTL = 2  # Seconds account stats are served from memory between status page polls
+LOG_DETAILS_PAGE_SIZE = 500  # Email status rows shown per page of a log's details
 
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['ATTACHMENTS_FOLDER'] = ATTACHMENTS_FOLDER
 app.config['MAX_CONTENT_LENGTH'] = MAX_CONTENT_LENGTH
 
+# Keep compiled templates on disk so a restarted worker doesn't recompile them on first render
+app.jinja_env.bytecode_cache = FileSystemBytecodeCache()
+
 # Create folders if they don't exist
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 os.makedirs(ATTACHMENTS_FOLDER, exist_ok=True)
@@ -76,14 +101,36 @@ def get_database_url():
         # Local development configuration
         return f"postgresql://{os.getenv('DB_USER', 'postgres')}:{os.getenv('DB_PASSWORD', 'password')}@{os.getenv('DB_HOST', 'localhost')}:{os.getenv('DB_PORT', '5432')}/{os.getenv('DB_NAME', 'email_system')}"
 
+# Session settings applied to every pooled connection at connect time: durable commits
+# (accounts, passwords and OTPs must survive a crash), give up on row locks instead of
+# queueing forever, and end sessions that sit idle inside a transaction so they can't
+# hold locks indefinitely. Campaign bookkeeping relaxes durability per transaction
+# with SET LOCAL synchronous_commit = off
+DB_SYNCHRONOUS_COMMIT = os.getenv('DB_SYNCHRONOUS_COMMIT', 'on')
+DB_LOCK_TIMEOUT_MS = int(os.getenv('DB_LOCK_TIMEOUT_MS', 30000))
+DB_IDLE_IN_TRANSACTION_TIMEOUT_MS = int(os.getenv('DB_IDLE_IN_TRANSACTION_TIMEOUT_MS', 60000))
+DB_SESSION_OPTIONS = (
+    f"-c synchronous_commit={DB_SYNCHRONOUS_COMMIT} -c lock_timeout={DB_LOCK_TIMEOUT_MS} "
+    f"-c idle_in_transaction_session_timeout={DB_IDLE_IN_TRANSACTION_TIMEOUT_MS}"
+)
+
+# Keep a few connections warm for request handlers and campaigns, and cap the
+# total so the server's connection limit is never the bottleneck
+DB_POOL_MIN_SIZE = int(os.getenv('DB_POOL_MIN_SIZE', min(CAMPAIGN_WORKERS, 4)))
+DB_POOL_MAX_SIZE = int(os.getenv('DB_POOL_MAX_SIZE', max(20, CAMPAIGN_WORKERS * 2 + 4)))
+
 # Create connection pool
 try:
     connection_pool = ConnectionPool(
         get_database_url(),
-        min_size=1,
-        max_size=20
+        min_size=DB_POOL_MIN_SIZE,
+        max_size=DB_POOL_MAX_SIZE,
+        kwargs={'options': DB_SESSION_OPTIONS},
+        # Replace connections the server dropped while idle before handing them out
+        check=ConnectionPool.check_connection
     )
     if connection_pool:
+        atexit.register(connection_pool.close)
         logger.info("PostgreSQL connection pool created successfully")
 except Exception as e:
     logger.error(f"Error creating connection pool: {e}")
@@ -110,12 +157,32 @@ def login_required(f):
     return decorated_function
 
 # Initialize database
+# Bump whenever init_database's tables or indexes change so existing databases are migrated
+SCHEMA_VERSION = 1
+
+def get_schema_version(cursor):
+    """Schema version recorded by the last init_database run; 0 for a new database"""
+    cursor.execute("SELECT to_regclass('schema_version') IS NOT NULL")
+    if not cursor.fetchone()[0]:
+        return 0
+    cursor.execute('SELECT MAX(version) FROM schema_version')
+    return cursor.fetchone()[0] or 0
+
 def init_database():
-    """Initialize PostgreSQL database with required tables"""
+    """Initialize PostgreSQL database with required tables
+    
+    Skipped when the database is already at SCHEMA_VERSION, so a worker restart doesn't
+    take table locks for index DDL or re-run ANALYZE.
+    """
     try:
         with get_db_connection() as conn:
             with conn.cursor() as cursor:
                 
+                if get_schema_version(cursor) >= SCHEMA_VERSION:
+                    conn.rollback()
+                    logger.info(f"PostgreSQL database schema is up to date (version {SCHEMA_VERSION})")
+                    return
+                
                 # Create users table
                 cursor.execute('''
                     CREATE TABLE IF NOT EXISTS users (
@@ -194,12 +261,29 @@ def init_database():
                 ''')
                 
                 # Create indexes for better performance
-                cursor.execute('CREATE INDEX IF NOT EXISTS idx_email_accounts_user_id ON email_accounts(user_id)')
-                cursor.execute('CREATE INDEX IF NOT EXISTS idx_email_accounts_email ON email_accounts(email)')
-                cursor.execute('CREATE INDEX IF NOT EXISTS idx_email_logs_user_id ON email_logs(user_id)')
-                cursor.execute('CREATE INDEX IF NOT EXISTS idx_email_status_log_id ON email_status(log_id)')
                 cursor.execute('CREATE INDEX IF NOT EXISTS idx_password_reset_email ON password_reset_otp(email)')
                 
+                # Single-column indexes that are a prefix of UNIQUE(user_id, email) or of the
+                # composite indexes below serve no extra queries and only slow down writes
+                cursor.execute('DROP INDEX IF EXISTS idx_email_accounts_user_id')
+                cursor.execute('DROP INDEX IF EXISTS idx_email_accounts_email')
+                cursor.execute('DROP INDEX IF EXISTS idx_email_logs_user_id')
+                cursor.execute('DROP INDEX IF EXISTS idx_email_status_log_id')
+                cursor.execute('DROP INDEX IF EXISTS idx_email_status_log_sent')
+                
+                # Cover the sender-selection, log listing and log detail queries
+                cursor.execute('CREATE INDEX IF NOT EXISTS idx_email_accounts_available ON email_accounts(user_id, is_active, sent_count, created_at)')
+                cursor.execute('CREATE INDEX IF NOT EXISTS idx_email_logs_user_created ON email_logs(user_id, created_at DESC)')
+                cursor.execute('CREATE INDEX IF NOT EXISTS idx_email_status_log_page ON email_status(log_id, id)')
+                
+                # Refresh planner statistics so the new indexes are picked up
+                cursor.execute('ANALYZE email_accounts, email_logs, email_status')
+                
+                # Record the schema version so later startups skip all of the above
+                cursor.execute('CREATE TABLE IF NOT EXISTS schema_version (version INTEGER NOT NULL)')
+                cursor.execute('DELETE FROM schema_version')
+                cursor.execute('INSERT INTO schema_version (version) VALUES (%s)', (SCHEMA_VERSION,))
+                
                 conn.commit()
                 logger.info("PostgreSQL database initialized successfully")
                 
@@ -213,13 +297,21 @@ try:
 except Exception as e:
     logger.error(f"Failed to initialize database: {e}")
 
+# Process-wide pool for background campaigns; the semaphore bounds running + queued campaigns
+campaign_pool = ThreadPoolExecutor(max_workers=CAMPAIGN_WORKERS, thread_name_prefix='campaign')
+campaign_slots = BoundedSemaphore(MAX_PENDING_CAMPAIGNS)
+
 # Global variable to store current email sending status (per user)
 email_status = {}
+email_status_lock = Lock()
 
 def get_user_email_status(user_id):
     """Get or create email status for a specific user"""
-    if user_id not in email_status:
-        email_status[user_id] = {
+    user_status = email_status.get(user_id)
+    if user_status is not None:
+        return user_status
+    with email_status_lock:
+        return email_status.setdefault(user_id, {
             'is_sending': False,
             'total_emails': 0,
             'sent_count': 0,
@@ -229,12 +321,24 @@ def get_user_email_status(user_id):
             'sender_rotation': {},
             'start_time': None,
             'failed_emails': [],
-            'success_emails': [],
+            'results_file': None,
             'attachment_name': None,
             'cc_emails': [],
-            'bcc_emails': []
-        }
-    return email_status[user_id]
+            'bcc_emails': [],
+            'last_result': None
+        })
+
+def begin_user_campaign(user_status):
+    """Mark a user's campaign as running; False if one already is
+    
+    The check and the update happen under email_status_lock, so a form submitted
+    twice can't start two campaigns for the same user.
+    """
+    with email_status_lock:
+        if user_status['is_sending']:
+            return False
+        user_status.update({'is_sending': True, 'last_result': None, 'current_email': '', 'sent_count': 0, 'failed_count': 0, 'total_emails': 0})
+        return True
 
 # User management functions
 def create_user(email, password, full_name):
@@ -330,6 +434,7 @@ def add_email_account(user_id, email, password, default_cc='', default_bcc=''):
                     VALUES (%s, %s, %s, %s, %s)
                 ''', (user_id, email, password, default_cc, default_bcc))
                 conn.commit()
+                invalidate_account_stats(user_id)
                 logger.info(f"Added email account: {email} for user {user_id}")
                 return True, "Email account added successfully"
     except psycopg.IntegrityError:
@@ -352,6 +457,7 @@ def update_email_account(user_id, account_id, email, password, is_active, defaul
                 
                 if cursor.rowcount > 0:
                     conn.commit()
+                    invalidate_account_stats(user_id)
                     logger.info(f"Updated email account ID: {account_id} for user {user_id}")
                     return True, "Email account updated successfully"
                 else:
@@ -371,6 +477,7 @@ def delete_email_account(user_id, account_id):
                 
                 if cursor.rowcount > 0:
                     conn.commit()
+                    invalidate_account_stats(user_id)
                     logger.info(f"Deleted email account ID: {account_id} for user {user_id}")
                     return True, "Email account deleted successfully"
                 else:
@@ -393,10 +500,26 @@ def get_account_default_cc_bcc(user_id, sender_email):
                 return result['default_cc'] or '', result['default_bcc'] or ''
             return '', ''
 
+daily_reset_dates = {}
+daily_reset_lock = Lock()
+
 def reset_daily_counts(user_id):
-    """Reset email counts daily for a specific user"""
-    today = date.today()
+    """Reset email counts daily for a specific user
     
+    Runs the UPDATE at most once per user per day in this process; every account the
+    user has is brought up to date by that one statement.
+    """
+    today = date.today()
+    if daily_reset_dates.get(user_id) == today:
+        return
+    with daily_reset_lock:
+        if daily_reset_dates.get(user_id) == today:
+            return
+        reset_user_daily_counts(user_id, today)
+        daily_reset_dates[user_id] = today
+
+def reset_user_daily_counts(user_id, today):
+    """Zero the sent counts of a user's accounts that were last reset before today"""
     with get_db_connection() as conn:
         with conn.cursor() as cursor:
             cursor.execute('''
@@ -407,78 +530,151 @@ def reset_daily_counts(user_id):
             
             if cursor.rowcount > 0:
                 conn.commit()
+                invalidate_account_stats(user_id)
                 logger.info(f"Reset email count for {cursor.rowcount} accounts for user {user_id}")
 
-def get_available_sender(user_id):
-    """Get next available sender account for a specific user"""
-    reset_daily_counts(user_id)
-    
-    with get_db_connection() as conn:
-        with conn.cursor(row_factory=dict_row) as cursor:
-            cursor.execute('''
-                SELECT email, password, default_cc, default_bcc FROM email_accounts 
-                WHERE user_id = %s AND is_active = TRUE AND sent_count < %s 
-                ORDER BY sent_count ASC, created_at ASC 
-                LIMIT 1
-            ''', (user_id, EMAIL_LIMIT_PER_ACCOUNT))
-            
-            result = cursor.fetchone()
-            if result:
-                return result['email'], result['password'], result['default_cc'], result['default_bcc']
-            
-            # If all accounts have reached the limit, return the first active one
-            cursor.execute('''
-                SELECT email, password, default_cc, default_bcc FROM email_accounts 
-                WHERE user_id = %s AND is_active = TRUE 
-                ORDER BY created_at ASC 
-                LIMIT 1
-            ''', (user_id,))
-            
-            result = cursor.fetchone()
-            if result:
-                logger.warning(f"All accounts have reached daily limit for user {user_id}. Using {result['email']}")
-                return result['email'], result['password'], result['default_cc'], result['default_bcc']
-    
-    return None, None, None, None
+account_stats_cache = {}
+account_stats_cache_lock = Lock()
+
+def invalidate_account_stats(user_id):
+    """Drop a user's cached account stats after their accounts or counts change"""
+    with account_stats_cache_lock:
+        account_stats_cache.pop(user_id, None)
 
 def get_account_stats(user_id):
-    """Get statistics for all email accounts for a specific user"""
+    """Get statistics for all email accounts for a specific user
+    
+    Served from memory for ACCOUNT_STATS_TTL seconds, so the status page's polling
+    doesn't query the database on every request.
+    """
+    now = time.monotonic()
+    with account_stats_cache_lock:
+        cached = account_stats_cache.get(user_id)
+    if cached and cached[0] > now:
+        return cached[1]
+    
+    stats = load_account_stats(user_id)
+    with account_stats_cache_lock:
+        account_stats_cache[user_id] = (now + ACCOUNT_STATS_TTL, stats)
+    return stats
+
+def load_account_stats(user_id):
+    """Query statistics for all email accounts for a specific user"""
     reset_daily_counts(user_id)
     
     with get_db_connection() as conn:
         with conn.cursor(row_factory=dict_row) as cursor:
             cursor.execute('''
-                SELECT id, email, sent_count, is_active, default_cc, default_bcc, created_at
+                SELECT id, email, sent_count AS sent_today,
+                       CASE WHEN is_active THEN %(limit)s - sent_count ELSE 0 END AS remaining,
+                       %(limit)s::integer AS "limit",
+                       (sent_count * 100.0 / %(limit)s)::float8 AS percentage_used,
+                       is_active,
+                       COALESCE(default_cc, '') AS default_cc,
+                       COALESCE(default_bcc, '') AS default_bcc,
+                       created_at
                 FROM email_accounts 
-                WHERE user_id = %s
+                WHERE user_id = %(user_id)s
                 ORDER BY created_at
-            ''', (user_id,))
+            ''', {'limit': EMAIL_LIMIT_PER_ACCOUNT, 'user_id': user_id})
             
-            accounts = cursor.fetchall()
-            stats = []
-            
-            for account in accounts:
-                remaining = EMAIL_LIMIT_PER_ACCOUNT - account['sent_count'] if account['is_active'] else 0
-                stats.append({
-                    'id': account['id'],
-                    'email': account['email'],
-                    'sent_today': account['sent_count'],
-                    'remaining': remaining,
-                    'limit': EMAIL_LIMIT_PER_ACCOUNT,
-                    'percentage_used': (account['sent_count'] / EMAIL_LIMIT_PER_ACCOUNT) * 100,
-                    'is_active': account['is_active'],
-                    'default_cc': account['default_cc'] or '',
-                    'default_bcc': account['default_bcc'] or '',
-                    'created_at': account['created_at']
-                })
-            
-            return stats
+            return cursor.fetchall()
 
-def save_email_log(user_id, log_data, log_filename):
-    """Save email log to database for a specific user"""
+def open_results_log(user_id, start_time):
+    """Open the gzipped NDJSON file that records each send result of a campaign as it happens"""
+    results_path = os.path.join(LOGS_FOLDER, f"bulk_email_log_{user_id}_{start_time.strftime('%Y%m%d_%H%M%S')}.ndjson.gz")
+    return results_path, gzip.open(results_path, 'wt', encoding='utf-8')
+
+class SendProgress:
+    """One worker's send results, published to the shared status and results file in batches
+    
+    Counters are kept locally and merged into user_status under status_lock every
+    STATUS_PUBLISH_INTERVAL sends or STATUS_PUBLISH_SECONDS, whichever comes first,
+    so workers do not contend for the lock on every email.
+    """
+    def __init__(self, user_status, status_lock, results_file, publish_interval=STATUS_PUBLISH_INTERVAL):
+        self.user_status = user_status
+        self.status_lock = status_lock
+        self.results_file = results_file
+        self.publish_interval = publish_interval
+        self._reset()
+    
+    def _reset(self):
+        self.sent = 0
+        self.failed = 0
+        self.rotation = {}
+        self.failed_emails = []
+        self.lines = []
+        self.last_publish = time.monotonic()
+    
+    def record(self, recipient_email, sender_email, success, error_msg):
+        if success:
+            self.sent += 1
+            # Track which sender sent to which recipients
+            self.rotation[sender_email] = self.rotation.get(sender_email, 0) + 1
+        else:
+            self.failed += 1
+            self.failed_emails.append(f"{recipient_email}: {error_msg}")
+        
+        self.lines.append(json.dumps({
+            'recipient': recipient_email,
+            'sender': sender_email,
+            'status': 'success' if success else 'failed',
+            'error': None if success else error_msg,
+            'time': time.time()
+        }, separators=(',', ':')) + '\n')
+        
+        if (len(self.lines) >= self.publish_interval
+                or time.monotonic() - self.last_publish >= STATUS_PUBLISH_SECONDS):
+            self.publish()
+    
+    def publish(self):
+        if not self.lines:
+            return
+        user_status = self.user_status
+        with self.status_lock:
+            user_status['sent_count'] += self.sent
+            user_status['failed_count'] += self.failed
+            # Nested containers are replaced, never mutated, so /api/status can serialize
+            # a shallow copy of the status while workers keep publishing
+            rotation = dict(user_status['sender_rotation'])
+            for sender_email, count in self.rotation.items():
+                rotation[sender_email] = rotation.get(sender_email, 0) + count
+            user_status['sender_rotation'] = rotation
+            # Only a preview of failures stays in memory; the full record is in the results file
+            preview_room = FAILED_EMAILS_PREVIEW_LIMIT - len(user_status['failed_emails'])
+            if preview_room > 0 and self.failed_emails:
+                user_status['failed_emails'] = user_status['failed_emails'] + self.failed_emails[:preview_room]
+            self.results_file.write(''.join(self.lines))
+        self._reset()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.publish()
+
+def iter_send_results(results_path):
+    """Yield the send results recorded in a campaign's NDJSON results file"""
+    with gzip.open(results_path, 'rt', encoding='utf-8') as f:
+        for line in f:
+            yield json.loads(line)
+
+def serialize_log_data(log_data):
+    """Compact JSON for a campaign summary; timestamps such as account created_at become strings"""
+    return json.dumps(log_data, separators=(',', ':'), default=str)
+
+def save_email_log(user_id, log_data, log_filename, results_path=None, log_json=None):
+    """Save email log to database for a specific user
+    
+    Individual email statuses are streamed from the campaign's NDJSON results file.
+    Pass log_json to reuse an already serialized log_data.
+    """
     try:
         with get_db_connection() as conn:
             with conn.cursor() as cursor:
+                # Don't wait for the WAL flush; a crash can lose this log, never corrupt it
+                cursor.execute('SET LOCAL synchronous_commit = off')
                 
                 # Insert main log entry
                 cursor.execute('''
@@ -501,25 +697,18 @@ def save_email_log(user_id, log_data, log_filename):
                     ', '.join(log_data.get('cc_emails', [])),
                     ', '.join(log_data.get('bcc_emails', [])),
                     log_data.get('attachment_name', ''),
-                    json.dumps(log_data)
+                    log_json or serialize_log_data(log_data)
                 ))
                 
                 log_id = cursor.fetchone()[0]
                 
-                # Insert individual email statuses
-                for email in log_data.get('success_emails', []):
-                    cursor.execute('''
-                        INSERT INTO email_status (log_id, recipient_email, sender_email, status)
-                        VALUES (%s, %s, %s, %s)
-                    ''', (log_id, email, log_data.get('sender_email'), 'success'))
-                
-                for failed_entry in log_data.get('failed_emails', []):
-                    if ':' in failed_entry:
-                        email_addr, error = failed_entry.split(':', 1)
-                        cursor.execute('''
-                            INSERT INTO email_status (log_id, recipient_email, sender_email, status, error_message)
-                            VALUES (%s, %s, %s, %s, %s)
-                        ''', (log_id, email_addr.strip(), log_data.get('sender_email'), 'failed', error.strip()))
+                # Bulk load individual email statuses with COPY, in this same transaction
+                if results_path:
+                    with cursor.copy(
+                        'COPY email_status (log_id, recipient_email, sender_email, status, error_message) FROM STDIN'
+                    ) as copy:
+                        for result in iter_send_results(results_path):
+                            copy.write_row((log_id, result['recipient'], result['sender'], result['status'], result['error']))
                 
                 conn.commit()
                 logger.info(f"Saved email log to database: {log_filename} for user {user_id}")
@@ -527,27 +716,28 @@ def save_email_log(user_id, log_data, log_filename):
     except Exception as e:
         logger.error(f"Error saving email log to database: {e}")
 
-class SimpleDataFrame:
-    """Simple DataFrame-like class to replace pandas"""
-    def __init__(self, data, columns):
-        self.data = data
-        self.columns = columns
-    
-    def head(self, n=5):
-        return SimpleDataFrame(self.data[:n], self.columns)
-    
-    def to_dict(self, orient='records'):
-        return self.data
-    
-    def iterrows(self):
-        for i, row in enumerate(self.data):
-            yield i, row
-    
-    def __len__(self):
-        return len(self.data)
-    
-    def __getitem__(self, column):
-        return [row.get(column, '') for row in self.data]
+def write_campaign_log(user_id, log_data, log_filename, results_path):
+    """Write a finished campaign's summary JSON file and save it to the database"""
+    log_json = serialize_log_data(log_data)
+    with open(os.path.join(LOGS_FOLDER, log_filename), 'w') as f:
+        f.write(log_json)
+        f.flush()
+        os.fsync(f.fileno())
+    save_email_log(user_id, log_data, log_filename, results_path, log_json)
+
+def log_writer_loop():
+    """Drain log_writer_queue so campaign threads never wait on log file or database writes"""
+    while True:
+        user_id, log_data, log_filename, results_path = log_writer_queue.get()
+        try:
+            write_campaign_log(user_id, log_data, log_filename, results_path)
+        except Exception as e:
+            logger.error(f"Error writing campaign log {log_filename}: {e}", exc_info=True)
+        finally:
+            log_writer_queue.task_done()
+
+log_writer_queue = Queue()
+Thread(target=log_writer_loop, name='log-writer', daemon=True).start()
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
@@ -555,79 +745,168 @@ def allowed_file(filename):
 def allowed_attachment_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_ATTACHMENT_EXTENSIONS
 
-def read_csv_file(filepath):
-    """Read CSV file"""
+def iter_csv_file(filepath):
+    """Open a CSV file and return (columns, rows) with rows yielded lazily"""
+    file = open(filepath, 'r', encoding='utf-8')
     try:
-        data = []
-        with open(filepath, 'r', encoding='utf-8') as file:
-            reader = csv.DictReader(file)
-            columns = list(reader.fieldnames)
-            for row in reader:
-                data.append(dict(row))
-        return SimpleDataFrame(data, columns)
-    except Exception as e:
-        logger.error(f"Error reading CSV file: {e}")
-        return None
-
-def read_excel_file(filepath):
-    """Read Excel file using openpyxl"""
+        # Short rows fill missing cells with '' so every value is already a string
+        reader = csv.DictReader(file, restval='')
+        columns = list(reader.fieldnames)
+    except Exception:
+        file.close()
+        raise
+    
+    def rows():
+        with file:
+            yield from reader
+    
+    return columns, rows()
+
+def iter_excel_file(filepath):
+    """Open an Excel file with openpyxl and return (columns, rows) with rows yielded lazily"""
+    # Streaming reader: rows are parsed lazily instead of building the full sheet DOM
+    workbook = load_workbook(filepath, read_only=True, data_only=True, keep_links=False)
     try:
-        workbook = load_workbook(filepath)
-        sheet = workbook.active
+        sheet_rows = workbook.active.iter_rows(values_only=True)
         
         # Get column names from first row
-        columns = [str(cell.value) for cell in sheet[1] if cell.value is not None]
-        
-        # Get data from remaining rows
-        data = []
-        for row in sheet.iter_rows(min_row=2, values_only=True):
-            row_dict = {}
-            for i, value in enumerate(row):
-                if i < len(columns):
-                    row_dict[columns[i]] = str(value) if value is not None else ""
-            # Only add row if it has some data
-            if any(value.strip() for value in row_dict.values() if value):
-                data.append(row_dict)
-        
-        return SimpleDataFrame(data, columns)
-    except Exception as e:
-        logger.error(f"Error reading Excel file: {e}")
-        return None
-
-def read_file(filepath):
-    """Read CSV or Excel file and return SimpleDataFrame"""
+        header = next(sheet_rows, ())
+        columns = [str(value) for value in header if value is not None]
+    except Exception:
+        workbook.close()
+        raise
+    num_columns = len(columns)
+    
+    def rows():
+        try:
+            for row in sheet_rows:
+                # Formatted but blank rows come back as all None; skip them without building a dict
+                if row.count(None) == len(row):
+                    continue
+                row_dict = {}
+                non_empty = False
+                for i, value in enumerate(row):
+                    if i >= num_columns:
+                        break
+                    text = str(value) if value is not None else ""
+                    row_dict[columns[i]] = text
+                    # Track emptiness in the same pass instead of re-scanning the row
+                    if text and not text.isspace():
+                        non_empty = True
+                # Only yield row if it has some data
+                if non_empty:
+                    yield row_dict
+        finally:
+            workbook.close()
+    
+    return columns, rows()
+
+def read_file_iter(filepath):
+    """Open CSV or Excel file and return (columns, rows) with rows streamed from disk"""
     try:
         if filepath.endswith('.csv'):
-            return read_csv_file(filepath)
+            return iter_csv_file(filepath)
         elif filepath.endswith(('.xlsx', '.xls')):
-            return read_excel_file(filepath)
+            return iter_excel_file(filepath)
         else:
             return None
     except Exception as e:
         logger.error(f"Error reading file: {e}")
         return None
 
-def format_email_content(content):
-    """Convert plain text to HTML while preserving formatting exactly as typed"""
-    # Escape HTML characters first
-    content = html.escape(content)
-    
-    # Normalize line endings
-    content = content.replace('\r\n', '\n').replace('\r', '\n')
-    
-    # Convert single line breaks to <br> and double line breaks to <br><br>
-    # First, replace double line breaks with a unique placeholder
-    content = content.replace('\n\n', '|||DOUBLE_BREAK|||')
+def last_index(columns, name):
+    """Position of the last column called name; rows are dicts, so a later duplicate wins"""
+    return len(columns) - 1 - columns[::-1].index(name)
+
+def count_recipients(filepath, email_column):
+    """Count rows with a recipient address, looking only at the email column
     
-    # Then replace single line breaks with <br>
-    content = content.replace('\n', '<br>')
+    Matches iter_valid_rows over read_file_iter without building a dict per row.
+    """
+    if filepath.endswith('.csv'):
+        with open(filepath, 'r', encoding='utf-8') as file:
+            reader = csv.reader(file)
+            index = last_index(next(reader, []), email_column)
+            return sum(1 for row in reader if len(row) > index and row[index].strip())
     
-    # Finally, replace the placeholder with double <br>
-    content = content.replace('|||DOUBLE_BREAK|||', '<br><br>')
+    workbook = load_workbook(filepath, read_only=True, data_only=True, keep_links=False)
+    try:
+        sheet_rows = workbook.active.iter_rows(values_only=True)
+        header = next(sheet_rows, ())
+        index = last_index([str(value) for value in header if value is not None], email_column)
+        count = 0
+        for row in sheet_rows:
+            if len(row) > index and row[index] is not None and str(row[index]).strip():
+                count += 1
+        return count
+    finally:
+        workbook.close()
+
+def read_file_preview(filepath, n=5):
+    """Return (columns, first n rows) of a CSV or Excel file without reading the rest"""
+    opened = read_file_iter(filepath)
+    if opened is None:
+        return None
+    columns, rows = opened
+    try:
+        with closing(rows):
+            return columns, list(islice(rows, n))
+    except Exception as e:
+        logger.error(f"Error reading file: {e}")
+        return None
+
+def is_html_content(content):
+    """Detect templates that are already written as HTML markup"""
+    return content.lstrip().startswith('<') and '</' in content
+
+PLACEHOLDER_PATTERN = re.compile(r'\{([^{}]+)\}')
+
+def compile_template(template, columns):
+    """Split template once into alternating literal text and referenced column names
+    
+    Even indexes hold literal text and odd indexes hold column names, so rendering
+    a row is a single join with no per-row parsing of the template.
+    """
+    # One regex pass splits out every {name}; names that are not columns stay literal text
+    pieces = PLACEHOLDER_PATTERN.split(template)
+    column_set = set(columns)
+    compiled = [pieces[0]]
+    for name, literal in zip(pieces[1::2], pieces[2::2]):
+        if name in column_set:
+            compiled.extend((name, literal))
+        else:
+            compiled[-1] += f"{{{name}}}{literal}"
+    return tuple(compiled)
+
+def personalize_template(compiled_template, row):
+    """Render a compiled template for one row"""
+    # Templates without placeholders are sent verbatim, sharing the same string
+    if len(compiled_template) == 1:
+        return compiled_template[0]
+    get = row.get
+    parts = list(compiled_template)
+    parts[1::2] = [get(col, "") for col in compiled_template[1::2]]
+    return ''.join(parts)
+
+# Every line break (any line ending) becomes <br>, so a blank line becomes <br><br>;
+# runs of spaces and tabs become non-breaking spaces
+PLAIN_TEXT_PATTERN = re.compile(r'\r\n|\r|\n|  |\t')
+PLAIN_TEXT_REPLACEMENTS = {
+    '\r\n': '<br>',
+    '\r': '<br>',
+    '\n': '<br>',
+    '  ': '&nbsp;&nbsp;',
+    '\t': '&nbsp;&nbsp;&nbsp;&nbsp;',
+}
+
+def format_email_content(content, is_html=False):
+    """Convert plain text to HTML while preserving formatting exactly as typed"""
+    # Content that is already HTML is sent as-is; escaping it would destroy the markup
+    if is_html:
+        return content
     
-    # Handle spacing
-    content = content.replace('  ', '&nbsp;&nbsp;')
-    content = content.replace('\t', '&nbsp;&nbsp;&nbsp;&nbsp;')
+    # Escape HTML characters, then convert line breaks and spacing in one pass
+    content = PLAIN_TEXT_PATTERN.sub(lambda m: PLAIN_TEXT_REPLACEMENTS[m.group(0)], html.escape(content))
     
     # Wrap in a div with proper styling
     html_content = f'''
@@ -643,32 +922,307 @@ def format_email_content(content):
     
     return html_content
 
+@lru_cache(maxsize=64)
+def build_body_parts(body, is_html=False):
+    """Build the plain text and HTML alternative parts for a body
+    
+    Cached because campaigns without placeholders send the same body to every recipient;
+    the parts are only read when a message is serialized, so messages can share them.
+    """
+    text_part = MIMEPart(policy=policy.SMTP)
+    text_part.set_content(body)
+    html_part = MIMEPart(policy=policy.SMTP)
+    html_part.set_content(format_email_content(body, is_html), subtype='html')
+    return text_part, html_part
+
 def parse_email_list(email_string):
     """Parse comma-separated email addresses"""
     if not email_string:
         return []
     
-    emails = [email.strip() for email in email_string.split(',') if email.strip()]
-    return emails
+    # Strip each address once; blank entries (",," or a trailing comma) are dropped
+    return [email for email in map(str.strip, email_string.split(',')) if email]
+
+def merge_email_lists(*email_strings):
+    """Merge comma-separated address lists in order, dropping duplicates
+    
+    Addresses are compared case-insensitively and the first spelling is kept.
+    """
+    merged = []
+    seen = set()
+    for email_string in email_strings:
+        if not email_string:
+            continue
+        for email in parse_email_list(email_string):
+            key = email.lower()
+            if key not in seen:
+                seen.add(key)
+                merged.append(email)
+    return merged
 
 def merge_cc_bcc_lists(form_cc, form_bcc, default_cc, default_bcc):
     """Merge form CC/BCC with default CC/BCC, removing duplicates"""
-    # Parse all email lists
-    form_cc_list = parse_email_list(form_cc) if form_cc else []
-    form_bcc_list = parse_email_list(form_bcc) if form_bcc else []
-    default_cc_list = parse_email_list(default_cc) if default_cc else []
-    default_bcc_list = parse_email_list(default_bcc) if default_bcc else []
+    return merge_email_lists(form_cc, default_cc), merge_email_lists(form_bcc, default_bcc)
+
+@lru_cache(maxsize=16)
+def load_attachment(attachment_path, mtime):
+    """Read and encode an attachment once, cached by (path, mtime) so edits invalidate it"""
+    with open(attachment_path, 'rb') as f:
+        attachment_data = f.read()
+    
+    filename = os.path.basename(attachment_path)
     
-    # Merge and remove duplicates while preserving order
-    merged_cc = list(dict.fromkeys(form_cc_list + default_cc_list))
-    merged_bcc = list(dict.fromkeys(form_bcc_list + default_bcc_list))
+    # Determine MIME type based on file extension
+    subtype = 'pdf' if filename.lower().endswith('.pdf') else 'octet-stream'
     
-    return merged_cc, merged_bcc
+    attachment = MIMEPart(policy=policy.SMTP)
+    attachment.set_content(attachment_data, maintype='application', subtype=subtype, filename=filename)
+    return attachment
 
-def send_email_smtp(smtp_server, smtp_port, sender_email, sender_password, recipient_email, subject, body, user_id, cc_emails=None, bcc_emails=None, attachment_path=None):
-    """Send individual email via SMTP with CC, BCC, and attachment support"""
+def prepare_attachment(attachment_path):
+    """Build a campaign's attachment part once; None if there is none or it cannot be read"""
+    if not attachment_path:
+        return None
     try:
-        msg = MIMEMultipart('alternative')
+        # One stat both checks the file is there and keys the cache on its mtime
+        attachment = load_attachment(attachment_path, os.stat(attachment_path).st_mtime)
+        logger.info(f"Prepared attachment: {os.path.basename(attachment_path)}")
+        return attachment
+    except FileNotFoundError:
+        logger.warning(f"Attachment file {attachment_path} no longer exists; sending without it")
+        return None
+    except Exception as e:
+        logger.warning(f"Failed to attach file {attachment_path}: {e}")
+        return None
+
+def attachment_warnings(user_status, attachment_path, attachment):
+    """Warnings for the campaign result when its attachment could not be prepared"""
+    if not attachment_path or attachment is not None:
+        return []
+    user_status['attachment_name'] = None
+    return [f"Attachment {os.path.basename(attachment_path)} could not be read; the emails were sent without it."]
+
+def is_throttle_error(error):
+    """True for transient 4xx SMTP replies such as 421/450/451 rate limiting"""
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return any(400 <= code < 500 for code, _ in error.recipients.values())
+    return 400 <= error.smtp_code < 500
+
+class TokenBucket:
+    """Send rate limiter for one sender; acquire() waits only as long as this sender needs"""
+    def __init__(self, rate, burst=1):
+        self.base_rate = rate
+        self.rate = rate
+        self.capacity = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.throttled_until = 0
+        self.lock = Lock()
+    
+    @classmethod
+    def for_sender(cls, sender_email, delay):
+        """Process-wide bucket allowing one send per delay seconds from one sender; None when there is no delay
+        
+        Campaigns that run at the same time from the same account share one pace
+        (and one throttle), set by the campaign that started most recently.
+        """
+        if delay <= 0:
+            return None
+        with sender_rate_limiters_lock:
+            bucket = sender_rate_limiters.get(sender_email)
+            if bucket is None:
+                bucket = sender_rate_limiters[sender_email] = cls(1 / delay)
+            else:
+                bucket.set_rate(1 / delay)
+            return bucket
+    
+    def set_rate(self, rate):
+        with self.lock:
+            self._refill(time.monotonic())
+            if self.rate == self.base_rate:
+                self.rate = rate
+            self.base_rate = rate
+    
+    def _refill(self, now):
+        if self.rate != self.base_rate and now >= self.throttled_until:
+            self.rate = self.base_rate
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+    
+    def acquire(self):
+        while True:
+            with self.lock:
+                self._refill(time.monotonic())
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+    
+    def throttle(self):
+        """Halve the rate for a while after the provider asks us to slow down"""
+        with self.lock:
+            self._refill(time.monotonic())
+            self.rate = max(self.rate / 2, self.base_rate / 16)
+            self.throttled_until = time.monotonic() + SMTP_THROTTLE_SECONDS
+
+sender_rate_limiters = {}
+sender_rate_limiters_lock = Lock()
+
+class SMTPSession:
+    """Authenticated SMTP connection reused across a batch of emails from one sender
+    
+    An optional TokenBucket paces the sends and is slowed down on 4xx replies.
+    """
+    def __init__(self, smtp_server, smtp_port, sender_email, sender_password, rate_limiter=None):
+        self.smtp_server = smtp_server
+        self.smtp_port = smtp_port
+        self.sender_email = sender_email
+        self.sender_password = sender_password
+        self.rate_limiter = rate_limiter
+        self.server = None
+        self.send_attempts = 0
+    
+    def connect(self):
+        self.close()
+        server = smtplib.SMTP(self.smtp_server, self.smtp_port)
+        server.starttls()
+        server.login(self.sender_email, self.sender_password)
+        self.server = server
+    
+    def reconnect(self):
+        """Reopen the connection, backing off exponentially between failed attempts"""
+        for attempt in range(SMTP_RECONNECT_ATTEMPTS):
+            try:
+                self.connect()
+                return
+            except (smtplib.SMTPException, OSError) as e:
+                if attempt == SMTP_RECONNECT_ATTEMPTS - 1:
+                    raise
+                wait = 2 ** attempt
+                logger.warning(f"Reconnecting {self.sender_email} failed ({e}), retrying in {wait}s")
+                time.sleep(wait)
+    
+    def close(self):
+        if self.server is not None:
+            try:
+                self.server.quit()
+            except Exception:
+                pass
+            self.server = None
+    
+    def abort(self):
+        """Drop the connection without QUIT, for when it may be left in the middle of DATA"""
+        if self.server is not None:
+            self.server.close()
+            self.server = None
+    
+    def is_alive(self):
+        try:
+            return self.server.noop()[0] == 250
+        except smtplib.SMTPException:
+            return False
+    
+    def send_message(self, msg, to_addrs):
+        if self.rate_limiter is not None:
+            self.rate_limiter.acquire()
+        
+        # The health-check interval counts attempts, not successes, so a run of rejected
+        # recipients doesn't trigger a NOOP before every send
+        if self.server is None:
+            self.connect()
+        elif self.send_attempts % SMTP_NOOP_INTERVAL == 0 and not self.is_alive():
+            logger.info(f"SMTP connection for {self.sender_email} went stale, reconnecting")
+            self.reconnect()
+        self.send_attempts += 1
+        
+        try:
+            try:
+                self._send(msg, to_addrs)
+            except smtplib.SMTPServerDisconnected:
+                logger.warning(f"SMTP server disconnected {self.sender_email}, reconnecting")
+                self.reconnect()
+                self._send(msg, to_addrs)
+        except (smtplib.SMTPResponseException, smtplib.SMTPRecipientsRefused) as e:
+            if self.rate_limiter is not None and is_throttle_error(e):
+                logger.warning(f"SMTP server is throttling {self.sender_email}, slowing down")
+                self.rate_limiter.throttle()
+            raise
+    
+    def _send(self, msg, to_addrs):
+        if self.server.has_extn('pipelining'):
+            self._send_pipelined(msg, to_addrs)
+        else:
+            self.server.send_message(msg, from_addr=self.sender_email, to_addrs=to_addrs)
+    
+    def _send_pipelined(self, msg, to_addrs):
+        """Send MAIL FROM, every RCPT TO and DATA in one write (RFC 2920), then read the replies in order
+        
+        Once DATA may have been accepted, any failure drops the connection instead of
+        leaving it half way through a message for the next send.
+        """
+        server = self.server
+        # Serialize before writing anything, so a message that fails to encode never reaches DATA;
+        # dot-stuff the payload and terminate it, as SMTP.data() would
+        payload = re.sub(rb'(?m)^\.', b'..', msg.as_bytes())
+        if not payload.endswith(b'\r\n'):
+            payload += b'\r\n'
+        
+        commands = [f"MAIL FROM:{smtplib.quoteaddr(self.sender_email)}"]
+        commands.extend(f"RCPT TO:{smtplib.quoteaddr(addr)}" for addr in to_addrs)
+        commands.append("DATA")
+        try:
+            server.send(''.join(f"{command}\r\n" for command in commands))
+            mail_reply = server.getreply()
+            rcpt_replies = [server.getreply() for _ in to_addrs]
+            data_code, data_resp = server.getreply()
+        except Exception:
+            self.abort()
+            raise
+        
+        refused = {addr: reply for addr, reply in zip(to_addrs, rcpt_replies) if reply[0] not in (250, 251)}
+        if mail_reply[0] != 250:
+            error = smtplib.SMTPSenderRefused(mail_reply[0], mail_reply[1], self.sender_email)
+        elif len(refused) == len(to_addrs):
+            error = smtplib.SMTPRecipientsRefused(refused)
+        elif data_code != 354:
+            error = smtplib.SMTPDataError(data_code, data_resp)
+        else:
+            error = None
+        if error is not None:
+            if data_code == 354:
+                # The server is waiting for a body that won't be sent
+                self.abort()
+            else:
+                server.rset()
+            raise error
+        
+        try:
+            server.send(payload + b'.\r\n')
+            code, resp = server.getreply()
+        except Exception:
+            self.abort()
+            raise
+        if code != 250:
+            self.abort()
+            raise smtplib.SMTPDataError(code, resp)
+        return refused
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+def send_email_smtp(smtp_server, smtp_port, sender_email, sender_password, recipient_email, subject, body, user_id, reservation, cc_emails=None, bcc_emails=None, attachment=None, is_html=False, smtp_session=None, content_type='both'):
+    """Send individual email via SMTP with CC, BCC, and attachment support
+    
+    attachment is a prebuilt part from prepare_attachment. Pass an open SMTPSession
+    to reuse its connection; otherwise one is opened and closed just for this message.
+    reservation is the campaign's QuotaReservation; a successful send is counted against it.
+    """
+    try:
+        msg = EmailMessage(policy=policy.SMTP)
         msg['From'] = sender_email
         msg['To'] = recipient_email
         msg['Subject'] = subject
@@ -677,66 +1231,37 @@ def send_email_smtp(smtp_server, smtp_port, sender_email, sender_password, recip
         if cc_emails:
             msg['CC'] = ', '.join(cc_emails)
         
-        # BCC is handled in sendmail, not in headers
-        
-        # Create plain text version (keep original formatting)
-        text_part = MIMEText(body, 'plain', 'utf-8')
+        # BCC is handled in send_message, not in headers
         
-        # Create HTML version with preserved formatting
-        formatted_body = format_email_content(body)
-        html_part = MIMEText(formatted_body, 'html', 'utf-8')
-        
-        # Attach parts to message (order matters - plain text first, then HTML)
-        msg.attach(text_part)
-        msg.attach(html_part)
+        # Plain text version first (keep original formatting), then HTML alternative
+        msg['MIME-Version'] = '1.0'
+        if content_type == 'html':
+            # A single body is set on the message itself so it carries its own charset
+            msg.set_content(format_email_content(body, is_html), subtype='html')
+        elif content_type == 'plain':
+            msg.set_content(body)
+        else:
+            msg.make_alternative()
+            for part in build_body_parts(body, is_html):
+                msg.attach(part)
         
         # Add attachment if provided
-        if attachment_path and os.path.exists(attachment_path):
-            try:
-                with open(attachment_path, 'rb') as f:
-                    attachment_data = f.read()
-                
-                filename = os.path.basename(attachment_path)
-                
-                # Determine MIME type based on file extension
-                if filename.lower().endswith('.pdf'):
-                    attachment = MIMEApplication(attachment_data, _subtype='pdf')
-                else:
-                    attachment = MIMEBase('application', 'octet-stream')
-                    attachment.set_payload(attachment_data)
-                    encoders.encode_base64(attachment)
-                
-                attachment.add_header('Content-Disposition', f'attachment; filename={filename}')
-                msg.attach(attachment)
-                logger.info(f"Attached file: {filename}")
-                
-            except Exception as e:
-                logger.warning(f"Failed to attach file {attachment_path}: {e}")
+        if attachment is not None:
+            msg.make_mixed()
+            msg.attach(attachment)
         
         # Prepare recipient list (To + CC + BCC)
-        all_recipients = [recipient_email]
-        if cc_emails:
-            all_recipients.extend(cc_emails)
-        if bcc_emails:
-            all_recipients.extend(bcc_emails)
+        all_recipients = (recipient_email, *(cc_emails or ()), *(bcc_emails or ()))
         
         # Send email
-        server = smtplib.SMTP(smtp_server, smtp_port)
-        server.starttls()
-        server.login(sender_email, sender_password)
-        text = msg.as_string()
-        server.sendmail(sender_email, all_recipients, text)
-        server.quit()
+        if smtp_session is None:
+            with SMTPSession(smtp_server, smtp_port, sender_email, sender_password) as session:
+                session.send_message(msg, all_recipients)
+        else:
+            smtp_session.send_message(msg, all_recipients)
         
-        # Update the account's sent count in database
-        with get_db_connection() as conn:
-            with conn.cursor() as cursor:
-                cursor.execute('''
-                    UPDATE email_accounts 
-                    SET sent_count = sent_count + 1 
-                    WHERE email = %s AND user_id = %s
-                ''', (sender_email, user_id))
-                conn.commit()
+        # The quota was reserved up front; unused quota is handed back when the campaign ends
+        reservation.increment(sender_email)
         
         logger.info(f"Email sent successfully to {recipient_email} from {sender_email} for user {user_id}")
         return True, "Email sent successfully"
@@ -891,7 +1416,7 @@ def send_otp_email(recipient_email, otp):
         msg.attach(html_part)
         
         # Send email
-        server = smtplib.SMTP("smtp.gmail.com", 587)
+        server = smtplib.SMTP(SMTP_SERVER, SMTP_PORT)
         server.starttls()
         server.login(otp_sender_email, otp_sender_password)
         text = msg.as_string()
@@ -1024,11 +1549,10 @@ def upload_file():
         filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
         file.save(filepath)
         
-        # Read file to get columns
-        df = read_file(filepath)
-        if df is not None:
-            columns = list(df.columns)
-            sample_data = df.head().to_dict('records')
+        # Read only the header and a few sample rows
+        preview = read_file_preview(filepath)
+        if preview is not None:
+            columns, sample_data = preview
             account_stats = get_account_stats(session['user_id'])
             
             return render_template('compose.html', 
@@ -1082,6 +1606,10 @@ def send_emails():
     template = request.form.get('template')
     email_column = request.form.get('email_column')
     delay = int(request.form.get('delay', 1))
+    concurrency = min(max(int(request.form.get('concurrency', DEFAULT_SMTP_CONCURRENCY)), 1), MAX_SMTP_CONCURRENCY)
+    content_type = request.form.get('content_type', 'both')
+    if content_type not in EMAIL_CONTENT_TYPES:
+        content_type = 'both'
     cc_emails = request.form.get('cc_emails', '').strip()
     bcc_emails = request.form.get('bcc_emails', '').strip()
     attachment_filename = request.form.get('attachment_filename', '').strip()
@@ -1122,22 +1650,10 @@ def send_emails():
         logger.error("No email accounts configured")
         return redirect(url_for('manage_accounts'))
     
-    # Check if selected sender has remaining quota
-    if sender_mode == 'manual' and selected_sender:
-        reset_daily_counts(user_id)
-        with get_db_connection() as conn:
-            with conn.cursor(row_factory=dict_row) as cursor:
-                cursor.execute('SELECT sent_count FROM email_accounts WHERE user_id = %s AND email = %s', (user_id, selected_sender))
-                account = cursor.fetchone()
-                if account and account['sent_count'] >= EMAIL_LIMIT_PER_ACCOUNT:
-                    flash(f'Selected account {selected_sender} has reached its daily limit of {EMAIL_LIMIT_PER_ACCOUNT} emails.')
-                    logger.warning(f"Account {selected_sender} has reached daily limit")
-                    return redirect(url_for('index'))
-    
     filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
     
     # Validate that the file exists
-    if not os.path.exists(filepath):
+    if not os.path.isfile(filepath):
         flash('Uploaded file not found. Please upload the file again.')
         logger.error(f"File not found: {filepath}")
         return redirect(url_for('index'))
@@ -1146,49 +1662,69 @@ def send_emails():
     attachment_path = None
     if attachment_filename:
         attachment_path = os.path.join(app.config['ATTACHMENTS_FOLDER'], attachment_filename)
-        if not os.path.exists(attachment_path):
+        if not os.path.isfile(attachment_path):
             flash('Attachment file not found. Please upload the attachment again.')
             logger.error(f"Attachment not found: {attachment_path}")
             return redirect(url_for('index'))
     
-    # Start sending emails in background thread
+    user_status = get_user_email_status(user_id)
+    
+    # Start sending emails in background thread; there is no request context there,
+    # so the outcome is stored in the user's status for the status page to show
     def send_emails_task():
+        messages = []
+        warnings = []
+        success = False
         try:
             if sender_mode == 'auto':
                 logger.info("Starting auto-rotate email sending")
                 success, result = send_bulk_emails(
                     user_id, filepath, subject, template, email_column, delay, 
-                    cc_emails, bcc_emails, attachment_path
+                    cc_emails, bcc_emails, attachment_path, concurrency, content_type
                 )
             else:  # manual mode
                 logger.info(f"Starting manual email sending with sender: {selected_sender}")
                 success, result = send_bulk_emails_single_sender(
                     user_id, filepath, selected_sender, subject, template, email_column, delay,
-                    cc_emails, bcc_emails, attachment_path
+                    cc_emails, bcc_emails, attachment_path, content_type
                 )
             
             if success:
-                flash(f"Bulk email sending completed! {result['success_count']} sent, {result['failed_count']} failed in {result['duration']}")
+                warnings.extend(result.get('warnings', ()))
+                messages.append(f"Bulk email sending completed! {result['success_count']} sent, {result['failed_count']} failed in {result['duration']}")
                 if result.get('sender_rotation'):
                     rotation_info = ", ".join([f"{email}: {count}" for email, count in result['sender_rotation'].items()])
-                    flash(f"Sender distribution: {rotation_info}")
+                    messages.append(f"Sender distribution: {rotation_info}")
                 if result['failed_emails']:
-                    flash(f"Failed emails: {', '.join(result['failed_emails'][:5])}")
+                    messages.append(f"Failed emails: {', '.join(result['failed_emails'][:5])}")
                 logger.info(f"Bulk email sending completed successfully: {result}")
             else:
-                flash(f"Error: {result}")
+                messages.append(f"Error: {result}")
                 logger.error(f"Bulk email sending failed: {result}")
         except Exception as e:
+            success = False
             error_msg = f"Error in email sending task: {str(e)}"
-            flash(error_msg)
+            messages.append(error_msg)
             logger.error(error_msg, exc_info=True)
+        finally:
+            user_status['last_result'] = {'success': success, 'messages': messages, 'warnings': warnings}
+            user_status['is_sending'] = False
     
-    thread = Thread(target=send_emails_task)
-    thread.daemon = True
-    thread.start()
+    if not campaign_slots.acquire(blocking=False):
+        flash('The server is busy sending other campaigns. Please try again in a few minutes.')
+        logger.warning(f"Campaign queue full, refusing new campaign for user {user_id}")
+        return redirect(url_for('index'))
+    
+    # Mark the campaign as running right away so the status page shows it while it is queued
+    if not begin_user_campaign(user_status):
+        campaign_slots.release()
+        flash('A campaign is already being sent. Wait for it to finish before starting another.')
+        return redirect(url_for('status'))
+    future = campaign_pool.submit(send_emails_task)
+    future.add_done_callback(lambda _: campaign_slots.release())
     
     flash('Email sending started in background. Check the status page for real-time updates.')
-    logger.info("Email sending thread started successfully")
+    logger.info("Email sending task queued successfully")
     return redirect(url_for('status'))
 
 @app.route('/manage_accounts')
@@ -1261,7 +1797,12 @@ def api_status():
     user_status = get_user_email_status(user_id)
     status_data = user_status.copy()
     status_data['account_stats'] = get_account_stats(user_id)
-    return jsonify(status_data)
+    
+    # Polls that see no change get an empty 304; the browser reuses its cached copy
+    response = jsonify(status_data)
+    response.headers['Cache-Control'] = 'no-cache'
+    response.add_etag()
+    return response.make_conditional(request)
 
 @app.route('/logs')
 @login_required
@@ -1270,48 +1811,33 @@ def logs():
     user_id = session['user_id']
     with get_db_connection() as conn:
         with conn.cursor(row_factory=dict_row) as cursor:
+            # The per-campaign counts are stored on the log row, so no join with email_status is needed
             cursor.execute('''
-                SELECT el.*, 
-                       COUNT(es.id) as total_recipients,
-                       SUM(CASE WHEN es.status = 'success' THEN 1 ELSE 0 END) as successful_sends,
-                       SUM(CASE WHEN es.status = 'failed' THEN 1 ELSE 0 END) as failed_sends
-                FROM email_logs el
-                LEFT JOIN email_status es ON el.id = es.log_id
-                WHERE el.user_id = %s
-                GROUP BY el.id
-                ORDER BY el.created_at DESC
+                SELECT id, log_filename, sender_email, sender_mode, total_emails, sent_count,
+                       failed_count, duration_seconds, subject, cc_emails, bcc_emails,
+                       attachment_name, created_at,
+                       COALESCE(sent_count, 0) + COALESCE(failed_count, 0) AS total_recipients,
+                       COALESCE(sent_count, 0) AS successful_sends,
+                       COALESCE(failed_count, 0) AS failed_sends
+                FROM email_logs
+                WHERE user_id = %s
+                ORDER BY created_at DESC
                 LIMIT 50
             ''', (user_id,))
-            
-            logs = []
-            for row in cursor.fetchall():
-                log_data = {
-                    'id': row['id'],
-                    'log_filename': row['log_filename'],
-                    'sender_email': row['sender_email'],
-                    'sender_mode': row['sender_mode'],
-                    'total_emails': row['total_emails'],
-                    'sent_count': row['sent_count'],
-                    'failed_count': row['failed_count'],
-                    'duration_seconds': row['duration_seconds'],
-                    'subject': row['subject'],
-                    'cc_emails': row['cc_emails'],
-                    'bcc_emails': row['bcc_emails'],
-                    'attachment_name': row['attachment_name'],
-                    'created_at': row['created_at'],
-                    'total_recipients': row['total_recipients'] or 0,
-                    'successful_sends': row['successful_sends'] or 0,
-                    'failed_sends': row['failed_sends'] or 0
-                }
-                logs.append(log_data)
+            logs = cursor.fetchall()
     
     return render_template('logs.html', logs=logs)
 
 @app.route('/log_details/<int:log_id>')
 @login_required
 def log_details(log_id):
-    """Display detailed log information for current user"""
+    """Display detailed log information for current user
+    
+    Email statuses are shown LOG_DETAILS_PAGE_SIZE at a time. ?after=<id> continues after
+    the last row of the previous page, so a page costs the same however large the log is.
+    """
     user_id = session['user_id']
+    after = request.args.get('after', 0, type=int)
     with get_db_connection() as conn:
         with conn.cursor(row_factory=dict_row) as cursor:
             
@@ -1323,23 +1849,45 @@ def log_details(log_id):
                 flash('Log not found.')
                 return redirect(url_for('logs'))
             
-            # Get email statuses
+            # Get one page of email statuses; a log's rows are written in send order by one
+            # COPY, so id order is sent_at order. One extra row tells whether a next page exists
             cursor.execute('''
-                SELECT recipient_email, sender_email, status, error_message, sent_at
+                SELECT id, recipient_email, sender_email, status, error_message, sent_at
                 FROM email_status 
-                WHERE log_id = %s
-                ORDER BY sent_at
-            ''', (log_id,))
+                WHERE log_id = %s AND id > %s
+                ORDER BY id
+                LIMIT %s
+            ''', (log_id, after, LOG_DETAILS_PAGE_SIZE + 1))
             
             email_statuses = cursor.fetchall()
     
-    return render_template('log_details.html', log=log, email_statuses=email_statuses)
+    next_after = None
+    if len(email_statuses) > LOG_DETAILS_PAGE_SIZE:
+        email_statuses = email_statuses[:LOG_DETAILS_PAGE_SIZE]
+        next_after = email_statuses[-1]['id']
+    
+    return render_template('log_details.html', log=log, email_statuses=email_statuses,
+                         after=after, next_after=next_after)
 
 # Health check endpoint for Render
+HEALTHY_RESPONSE_PREFIX = b'{"status":"healthy","timestamp":"'
+
 @app.route('/health')
 def health_check():
-    """Health check endpoint for deployment platforms"""
-    return jsonify({'status': 'healthy', 'timestamp': datetime.now().isoformat()})
+    """Health check endpoint for deployment platforms
+    
+    Probed constantly by the load balancer, so the body is assembled from
+    precomputed bytes rather than serialised with jsonify on every hit.
+    """
+    body = HEALTHY_RESPONSE_PREFIX + datetime.now().isoformat().encode() + b'"}'
+    return app.response_class(body, mimetype='application/json')
+
+@app.route('/health/db')
+def db_health_check():
+    """Connection pool statistics for monitoring"""
+    if not connection_pool:
+        return jsonify({'status': 'unavailable'}), 503
+    return jsonify({'status': 'healthy', 'pool': connection_pool.get_stats()})
 
 @app.route('/forgot_password', methods=['GET', 'POST'])
 def forgot_password():
@@ -1440,7 +1988,209 @@ def reset_password():
     
     return render_template('auth/reset_password.html')
 
-def send_bulk_emails(user_id, file_path, subject, template, email_column, delay=1, cc_emails=None, bcc_emails=None, attachment_path=None):
+def plan_sender_quotas(accounts, total_emails):
+    """Return [account, quota] pairs for every account with remaining daily quota
+    
+    Emails beyond the combined quota are added to the first account, matching the
+    old fallback of reusing the first active sender once every account is full.
+    """
+    plan = [[account, EMAIL_LIMIT_PER_ACCOUNT - account['sent_count']] for account in accounts]
+    plan = [entry for entry in plan if entry[1] > 0]
+    
+    overflow = total_emails - sum(quota for _, quota in plan)
+    if overflow > 0:
+        if plan and plan[0][0] is accounts[0]:
+            plan[0][1] += overflow
+        else:
+            plan.insert(0, [accounts[0], overflow])
+        logger.warning(f"All accounts have reached daily limit. Using {accounts[0]['email']} for {overflow} more emails")
+    return plan
+
+def reserve_sender_quotas(user_id, total_emails):
+    """Atomically claim daily quota for a campaign and return its [account, quota] plan
+    
+    The accounts are locked while the plan is made and the claimed quota is added to
+    sent_count up front, so concurrent campaigns can't both plan the same remaining quota.
+    """
+    with get_db_connection() as conn:
+        with conn.cursor(row_factory=dict_row) as cursor:
+            # Don't wait for the WAL flush on commit; a lost reservation only under-counts quota
+            cursor.execute('SET LOCAL synchronous_commit = off')
+            cursor.execute('''
+                SELECT id, email, password, is_active, sent_count, last_reset, 
+                       default_cc, default_bcc, created_at 
+                FROM email_accounts 
+                WHERE user_id = %s AND is_active = TRUE 
+                ORDER BY created_at
+                FOR UPDATE
+            ''', (user_id,))
+            accounts = cursor.fetchall()
+            if not accounts:
+                conn.rollback()
+                return []
+            
+            # Only claim what this campaign needs, earliest accounts first
+            plan = []
+            needed = total_emails
+            for account, quota in plan_sender_quotas(accounts, total_emails):
+                if needed <= 0:
+                    break
+                plan.append([account, min(quota, needed)])
+                needed -= plan[-1][1]
+            
+            cursor.executemany('''
+                UPDATE email_accounts 
+                SET sent_count = sent_count + %s 
+                WHERE id = %s
+            ''', [(quota, account['id']) for account, quota in plan])
+            conn.commit()
+            invalidate_account_stats(user_id)
+            return plan
+
+def reserve_single_sender_quota(user_id, sender_email, count):
+    """Atomically claim count sends from one account, applying its daily reset in the same statement
+    
+    Returns (account, remaining). When the claim fits, account is the account row and
+    remaining is the quota left after it; otherwise account is None and remaining is the
+    quota that was left (None if the account doesn't exist or is inactive). A claim of
+    zero sends is never granted.
+    """
+    today = date.today()
+    with get_db_connection() as conn:
+        with conn.cursor(row_factory=dict_row) as cursor:
+            cursor.execute('''
+                UPDATE email_accounts 
+                SET sent_count = (CASE WHEN last_reset < %(today)s THEN 0 ELSE sent_count END) + %(count)s,
+                    last_reset = %(today)s
+                WHERE user_id = %(user_id)s AND email = %(email)s AND is_active = TRUE
+                  AND %(count)s > 0
+                  AND (CASE WHEN last_reset < %(today)s THEN 0 ELSE sent_count END) + %(count)s <= %(limit)s
+                RETURNING id, email, password, default_cc, default_bcc, %(limit)s - sent_count AS remaining
+            ''', {'today': today, 'count': count, 'user_id': user_id, 'email': sender_email, 'limit': EMAIL_LIMIT_PER_ACCOUNT})
+            account = cursor.fetchone()
+            if account:
+                conn.commit()
+                invalidate_account_stats(user_id)
+                return account, account.pop('remaining')
+            
+            # Not claimed: find out whether the account is missing or just out of quota
+            cursor.execute('''
+                SELECT CASE WHEN last_reset < %s THEN 0 ELSE sent_count END AS sent_count
+                FROM email_accounts 
+                WHERE user_id = %s AND email = %s AND is_active = TRUE
+            ''', (today, user_id, sender_email))
+            result = cursor.fetchone()
+            conn.rollback()
+            if not result:
+                return None, None
+            return None, max(EMAIL_LIMIT_PER_ACCOUNT - result['sent_count'], 0)
+
+class QuotaReservation:
+    """Counts sends against a reserved plan and hands unused quota back when the campaign ends"""
+    def __init__(self, user_id, plan):
+        self.user_id = user_id
+        self.reserved = {}
+        for account, quota in plan:
+            self.reserved[account['id']] = (account['email'], quota)
+        self.sent = {}
+        self.lock = Lock()
+    
+    def increment(self, sender_email):
+        with self.lock:
+            self.sent[sender_email] = self.sent.get(sender_email, 0) + 1
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
+    
+    def release(self):
+        with self.lock:
+            unused = [
+                (quota - self.sent.get(email, 0), account_id)
+                for account_id, (email, quota) in self.reserved.items()
+                if quota > self.sent.get(email, 0)
+            ]
+            self.reserved = {}
+        if not unused:
+            return
+        try:
+            with get_db_connection() as conn:
+                with conn.cursor() as cursor:
+                    # Don't wait for the WAL flush; a lost release only holds quota until the daily reset
+                    cursor.execute('SET LOCAL synchronous_commit = off')
+                    cursor.executemany('''
+                        UPDATE email_accounts 
+                        SET sent_count = GREATEST(sent_count - %s, 0) 
+                        WHERE id = %s
+                    ''', unused)
+                    conn.commit()
+            invalidate_account_stats(self.user_id)
+        except Exception as e:
+            logger.error(f"Error releasing unused quota for user {self.user_id}: {e}")
+
+def iter_valid_rows(rows, email_column):
+    """Yield (recipient_email, row) for the rows that have a recipient address
+    
+    The address is stripped once here so the send loops can use it directly.
+    """
+    for row in rows:
+        recipient_email = row.get(email_column, '').strip()
+        if recipient_email:
+            yield recipient_email, row
+
+def put_with_backpressure(send_queue, item, futures):
+    """Block until item fits in the bounded queue; give up if every worker has stopped"""
+    while True:
+        try:
+            send_queue.put(item, timeout=1)
+            return True
+        except Full:
+            if all(future.done() for future in futures):
+                return False
+
+def send_sub_batch(user_id, user_status, status_lock, results_file, reservation, plan_queue, send_queue, subject, compiled_template, delay, cc_emails, bcc_emails, attachment, is_html, content_type):
+    """Worker: take sender accounts from plan_queue and send each one's quota of rows from send_queue
+    
+    Each account gets one SMTP connection, kept open until its quota is used up.
+    """
+    with SendProgress(user_status, status_lock, results_file) as progress:
+        while True:
+            try:
+                account, quota = plan_queue.get_nowait()
+            except Empty:
+                return
+            sender_email = account['email']
+            
+            # Merge form CC/BCC with default CC/BCC for this sender
+            merged_cc, merged_bcc = merge_cc_bcc_lists(
+                cc_emails, bcc_emails, account['default_cc'], account['default_bcc']
+            )
+            
+            rate_limiter = TokenBucket.for_sender(sender_email, delay)
+            with SMTPSession(SMTP_SERVER, SMTP_PORT, sender_email, account['password'], rate_limiter) as smtp_session:
+                for _ in range(quota):
+                    item = send_queue.get()
+                    if item is None:
+                        return
+                    
+                    recipient_email, row = item
+                    user_status['current_email'] = recipient_email
+                    user_status['current_sender'] = sender_email
+                    
+                    # Replace placeholders in template with row data
+                    personalized_message = personalize_template(compiled_template, row)
+                    
+                    success, error_msg = send_email_smtp(
+                        SMTP_SERVER, SMTP_PORT, sender_email, account['password'],
+                        recipient_email, subject, personalized_message, user_id, reservation, merged_cc, merged_bcc,
+                        attachment, is_html, smtp_session, content_type
+                    )
+                    
+                    progress.record(recipient_email, sender_email, success, error_msg)
+
+def send_bulk_emails(user_id, file_path, subject, template, email_column, delay=1, cc_emails=None, bcc_emails=None, attachment_path=None, concurrency=DEFAULT_SMTP_CONCURRENCY, content_type='both'):
     """Send bulk emails in background with automatic sender rotation for a specific user"""
     user_status = get_user_email_status(user_id)
     
@@ -1455,168 +2205,136 @@ def send_bulk_emails(user_id, file_path, subject, template, email_column, delay=
     
     # Reset status
     user_status.update({
-        'is_sending': True,
         'total_emails': 0,
         'sent_count': 0,
         'failed_count': 0,
         'current_email': '',
         'current_sender': '',
         'sender_rotation': {},
-        'start_time': None,
+        'start_time': datetime.now(),
         'failed_emails': [],
-        'success_emails': [],
+        'results_file': None,
         'attachment_name': os.path.basename(attachment_path) if attachment_path else None,
         'cc_emails': form_cc_list,
         'bcc_emails': form_bcc_list
     })
     
-    df = read_file(file_path)
-    if df is None:
-        user_status['is_sending'] = False
+    opened = read_file_iter(file_path)
+    if opened is None:
         return False, "Failed to read file"
+    columns, rows = opened
     
-    if email_column not in df.columns:
-        user_status['is_sending'] = False
+    rows.close()
+    if email_column not in columns:
         return False, f"Column '{email_column}' not found in file"
     
-    # Filter out empty emails and count total
-    valid_emails = [row for row in df.data if row.get(email_column, '').strip()]
-    user_status['total_emails'] = len(valid_emails)
+    # Count recipients in a pass over the email column only; the file is read again while sending
+    try:
+        user_status['total_emails'] = count_recipients(file_path, email_column)
+    except Exception as e:
+        logger.error(f"Error reading file {file_path}: {e}")
+        return False, "Failed to read file"
     
     logger.info(f"Starting bulk email sending to {user_status['total_emails']} recipients for user {user_id}")
     
-    smtp_server = "smtp.gmail.com"
-    smtp_port = 587
+    is_html = is_html_content(template)
+    compiled_template = compile_template(template, columns)
+    attachment = prepare_attachment(attachment_path)
+    warnings = attachment_warnings(user_status, attachment_path, attachment)
     
-    current_sender = None
-    current_password = None
-    current_default_cc = None
-    current_default_bcc = None
-    emails_sent_with_current = 0
-    
-    for index, row in enumerate(valid_emails):
-        recipient_email = row.get(email_column, '').strip()
-        user_status['current_email'] = recipient_email
-        
-        # Get next available sender if current one reached limit or is None
-        if (current_sender is None or emails_sent_with_current >= EMAIL_LIMIT_PER_ACCOUNT):
-            current_sender, current_password, current_default_cc, current_default_bcc = get_available_sender(user_id)
-            emails_sent_with_current = 0
-            
-            if current_sender is None:
-                logger.error(f"No available sender accounts for user {user_id}")
-                break
-        
-        user_status['current_sender'] = current_sender
-        
-        # Merge form CC/BCC with default CC/BCC for current sender
-        merged_cc, merged_bcc = merge_cc_bcc_lists(
-            cc_emails, bcc_emails, current_default_cc, current_default_bcc
-        )
-        
-        # Replace placeholders in template with row data
-        personalized_message = template
-        for col in df.columns:
-            placeholder = f"{{{col}}}"
-            if placeholder in personalized_message:
-                value = row.get(col, "")
-                personalized_message = personalized_message.replace(placeholder, str(value))
-        
-        success, error_msg = send_email_smtp(
-            smtp_server, smtp_port, current_sender, current_password,
-            recipient_email, subject, personalized_message, user_id, merged_cc, merged_bcc, attachment_path
-        )
+    # Up to `concurrency` workers, each working through accounts with reserved quota,
+    # all fed from a bounded queue
+    reset_daily_counts(user_id)
+    plan = reserve_sender_quotas(user_id, user_status['total_emails'])
+    plan_queue = Queue()
+    for entry in plan:
+        plan_queue.put(entry)
+    workers = max(min(concurrency, len(plan)), 1)
+    send_queue = Queue(maxsize=max(SEND_QUEUE_SIZE, workers))
+    status_lock = Lock()
+    reservation = QuotaReservation(user_id, plan)
+    results_path, results_file = open_results_log(user_id, user_status['start_time'])
+    user_status['results_file'] = os.path.basename(results_path)
+    
+    with results_file, reservation, ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(
+                send_sub_batch, user_id, user_status, status_lock, results_file, reservation, plan_queue, send_queue,
+                subject, compiled_template, delay, cc_emails, bcc_emails, attachment, is_html, content_type
+            ): worker
+            for worker in range(workers)
+        }
         
-        if success:
-            user_status['sent_count'] += 1
-            user_status['success_emails'].append(recipient_email)
-            emails_sent_with_current += 1
-            
-            # Track which sender sent to which recipients
-            if current_sender not in user_status['sender_rotation']:
-                user_status['sender_rotation'][current_sender] = 0
-            user_status['sender_rotation'][current_sender] += 1
-        else:
-            user_status['failed_count'] += 1
-            user_status['failed_emails'].append(f"{recipient_email}: {error_msg}")
+        # Stream rows to the workers; a full queue blocks reading until they catch up
+        try:
+            opened = read_file_iter(file_path)
+            if opened is None:
+                raise ValueError("file could not be reopened for sending")
+            _, rows = opened
+            with closing(rows):
+                for item in iter_valid_rows(rows, email_column):
+                    if not put_with_backpressure(send_queue, item, futures):
+                        logger.error(f"All sender workers stopped before the campaign finished for user {user_id}")
+                        break
+        except Exception as e:
+            logger.error(f"Error reading file {file_path} while sending for user {user_id}: {e}")
+        finally:
+            # Always release the workers, even if reading failed part way
+            for _ in range(workers):
+                put_with_backpressure(send_queue, None, futures)
         
-        # Add delay between emails to avoid being flagged as spam
-        time.sleep(delay)
+        for future in as_completed(futures):
+            try:
+                future.result()
+            except Exception as e:
+                logger.error(f"Sender worker {futures[future]} stopped unexpectedly for user {user_id}: {e}", exc_info=True)
     
-    # Email sending completed
-    user_status['is_sending'] = False
+    # Email sending completed; is_sending is cleared by send_emails_task once it has the result.
+    # Snapshot the status so the log and result are built from this campaign's final counts
+    final_status = user_status.copy()
     end_time = datetime.now()
-    duration = end_time - user_status['start_time']
+    duration = end_time - final_status['start_time']
     
     # Save detailed log to file and database
     log_data = {
         'timestamp': end_time.isoformat(),
         'duration_seconds': duration.total_seconds(),
-        'total_emails': user_status['total_emails'],
-        'sent_count': user_status['sent_count'],
-        'failed_count': user_status['failed_count'],
-        'success_emails': user_status['success_emails'],
-        'failed_emails': user_status['failed_emails'],
+        'total_emails': final_status['total_emails'],
+        'sent_count': final_status['sent_count'],
+        'failed_count': final_status['failed_count'],
+        'results_file': final_status['results_file'],
         'subject': subject,
         'sender_mode': 'auto',
-        'sender_rotation': user_status['sender_rotation'],
+        'sender_rotation': final_status['sender_rotation'],
         'cc_emails': form_cc_list,
         'bcc_emails': form_bcc_list,
-        'attachment_name': os.path.basename(attachment_path) if attachment_path else '',
+        'attachment_name': os.path.basename(attachment_path) if attachment is not None else '',
         'account_stats': get_account_stats(user_id)
     }
     
     log_filename = f"bulk_email_log_{user_id}_{end_time.strftime('%Y%m%d_%H%M%S')}.json"
     
-    # Save to file
-    with open(os.path.join(LOGS_FOLDER, log_filename), 'w') as f:
-        json.dump(log_data, f, indent=2)
-    
-    # Save to database
-    save_email_log(user_id, log_data, log_filename)
+    # Save to file and database on the log writer thread
+    log_writer_queue.put((user_id, log_data, log_filename, results_path))
     
-    logger.info(f"Bulk email sending completed for user {user_id}. {user_status['sent_count']} sent, {user_status['failed_count']} failed. Duration: {duration}")
+    logger.info(f"Bulk email sending completed for user {user_id}. {final_status['sent_count']} sent, {final_status['failed_count']} failed. Duration: {duration}")
     
     return True, {
-        'success_count': user_status['sent_count'],
-        'failed_count': user_status['failed_count'],
-        'failed_emails': user_status['failed_emails'],
+        'success_count': final_status['sent_count'],
+        'failed_count': final_status['failed_count'],
+        'failed_emails': final_status['failed_emails'],
         'duration': str(duration),
         'log_file': log_filename,
-        'sender_rotation': user_status['sender_rotation']
+        'sender_rotation': final_status['sender_rotation'],
+        'warnings': warnings
     }
 
-def send_bulk_emails_single_sender(user_id, file_path, sender_email, subject, template, email_column, delay=1, cc_emails=None, bcc_emails=None, attachment_path=None):
+def send_bulk_emails_single_sender(user_id, file_path, sender_email, subject, template, email_column, delay=1, cc_emails=None, bcc_emails=None, attachment_path=None, content_type='both'):
     """Send bulk emails using a single specific sender for a specific user"""
     user_status = get_user_email_status(user_id)
     
-    # Check if sender exists and has quota
-    with get_db_connection() as conn:
-        with conn.cursor(row_factory=dict_row) as cursor:
-            cursor.execute('''
-                SELECT email, password, sent_count, is_active, default_cc, default_bcc
-                FROM email_accounts 
-                WHERE user_id = %s AND email = %s AND is_active = TRUE
-            ''', (user_id, sender_email))
-            
-            account = cursor.fetchone()
-            if not account:
-                return False, "Selected sender account not found or inactive"
-            
-            reset_daily_counts(user_id)
-            if account['sent_count'] >= EMAIL_LIMIT_PER_ACCOUNT:
-                return False, f"Selected account has reached daily limit of {EMAIL_LIMIT_PER_ACCOUNT} emails"
-            
-            sender_password = account['password']
-            default_cc = account['default_cc'] or ''
-            default_bcc = account['default_bcc'] or ''
-    
-    # Merge form CC/BCC with default CC/BCC
-    merged_cc, merged_bcc = merge_cc_bcc_lists(cc_emails, bcc_emails, default_cc, default_bcc)
-    
     # Reset status
     user_status.update({
-        'is_sending': True,
         'total_emails': 0,
         'sent_count': 0,
         'failed_count': 0,
@@ -1625,104 +2343,115 @@ def send_bulk_emails_single_sender(user_id, file_path, sender_email, subject, te
         'sender_rotation': {sender_email: 0},
         'start_time': datetime.now(),
         'failed_emails': [],
-        'success_emails': [],
+        'results_file': None,
         'attachment_name': os.path.basename(attachment_path) if attachment_path else None,
-        'cc_emails': merged_cc,
-        'bcc_emails': merged_bcc
+        'cc_emails': [],
+        'bcc_emails': []
     })
     
-    df = read_file(file_path)
-    if df is None:
-        user_status['is_sending'] = False
+    opened = read_file_iter(file_path)
+    if opened is None:
         return False, "Failed to read file"
+    columns, rows = opened
     
-    if email_column not in df.columns:
-        user_status['is_sending'] = False
-        return False, f"Column '{email_column}' not found in file"
+    with closing(rows):
+        if email_column not in columns:
+            return False, f"Column '{email_column}' not found in file"
+        
+        # No account can send more than the daily limit; stop reading once past it
+        try:
+            valid_emails = list(islice(iter_valid_rows(rows, email_column), EMAIL_LIMIT_PER_ACCOUNT + 1))
+        except Exception as e:
+            logger.error(f"Error reading file {file_path}: {e}")
+            return False, "Failed to read file"
     
-    # Filter out empty emails and count total
-    valid_emails = [row for row in df.data if row.get(email_column, '').strip()]
+    if not valid_emails:
+        return False, f"No email addresses found in column '{email_column}'"
+    
+    # Claim quota for every recipient in one statement, or refuse the whole batch
+    account, remaining_quota = reserve_single_sender_quota(user_id, sender_email, len(valid_emails))
+    if account:
+        logger.info(f"Claimed {len(valid_emails)} sends from {sender_email}; {remaining_quota} left today")
+    else:
+        if remaining_quota is None:
+            return False, "Selected sender account not found or inactive"
+        if remaining_quota <= 0:
+            return False, f"Selected account has reached daily limit of {EMAIL_LIMIT_PER_ACCOUNT} emails"
+        return False, f"Cannot send more than {remaining_quota} emails. Account {sender_email} has only {remaining_quota} emails remaining today."
     user_status['total_emails'] = len(valid_emails)
+    sender_password = account['password']
     
-    # Check if we can send all emails with this account
-    remaining_quota = EMAIL_LIMIT_PER_ACCOUNT - account['sent_count']
-    if len(valid_emails) > remaining_quota:
-        user_status['is_sending'] = False
-        return False, f"Cannot send {len(valid_emails)} emails. Account {sender_email} has only {remaining_quota} emails remaining today."
+    # Merge form CC/BCC with default CC/BCC
+    merged_cc, merged_bcc = merge_cc_bcc_lists(cc_emails, bcc_emails, account['default_cc'] or '', account['default_bcc'] or '')
+    user_status['cc_emails'] = merged_cc
+    user_status['bcc_emails'] = merged_bcc
     
     logger.info(f"Starting bulk email sending to {user_status['total_emails']} recipients from {sender_email} for user {user_id}")
     
-    smtp_server = "smtp.gmail.com"
-    smtp_port = 587
-    
-    for index, row in enumerate(valid_emails):
-        recipient_email = row.get(email_column, '').strip()
-        user_status['current_email'] = recipient_email
-        
-        # Replace placeholders in template with row data
-        personalized_message = template
-        for col in df.columns:
-            placeholder = f"{{{col}}}"
-            if placeholder in personalized_message:
-                value = row.get(col, "")
-                personalized_message = personalized_message.replace(placeholder, str(value))
-        
-        success, error_msg = send_email_smtp(
-            smtp_server, smtp_port, sender_email, sender_password,
-            recipient_email, subject, personalized_message, user_id, merged_cc, merged_bcc, attachment_path
-        )
-        
-        if success:
-            user_status['sent_count'] += 1
-            user_status['success_emails'].append(recipient_email)
-            user_status['sender_rotation'][sender_email] += 1
-        else:
-            user_status['failed_count'] += 1
-            user_status['failed_emails'].append(f"{recipient_email}: {error_msg}")
-        
-        # Add delay between emails to avoid being flagged as spam
-        time.sleep(delay)
+    is_html = is_html_content(template)
+    compiled_template = compile_template(template, columns)
+    attachment = prepare_attachment(attachment_path)
+    warnings = attachment_warnings(user_status, attachment_path, attachment)
+    
+    reservation = QuotaReservation(user_id, [[account, len(valid_emails)]])
+    results_path, results_file = open_results_log(user_id, user_status['start_time'])
+    user_status['results_file'] = os.path.basename(results_path)
+    
+    # One connection (TLS + AUTH handshake) for the whole batch
+    rate_limiter = TokenBucket.for_sender(sender_email, delay)
+    with results_file, reservation, SMTPSession(SMTP_SERVER, SMTP_PORT, sender_email, sender_password, rate_limiter) as smtp_session, \
+            SendProgress(user_status, Lock(), results_file) as progress:
+        for recipient_email, row in valid_emails:
+            user_status['current_email'] = recipient_email
+            
+            # Replace placeholders in template with row data
+            personalized_message = personalize_template(compiled_template, row)
+            
+            success, error_msg = send_email_smtp(
+                SMTP_SERVER, SMTP_PORT, sender_email, sender_password,
+                recipient_email, subject, personalized_message, user_id, reservation, merged_cc, merged_bcc,
+                attachment, is_html, smtp_session, content_type
+            )
+            
+            progress.record(recipient_email, sender_email, success, error_msg)
     
-    # Email sending completed
-    user_status['is_sending'] = False
+    # Email sending completed; is_sending is cleared by send_emails_task once it has the result.
+    # Snapshot the status so the log and result are built from this campaign's final counts
+    final_status = user_status.copy()
     end_time = datetime.now()
-    duration = end_time - user_status['start_time']
+    duration = end_time - final_status['start_time']
     
     # Save detailed log to file and database
     log_data = {
         'timestamp': end_time.isoformat(),
         'duration_seconds': duration.total_seconds(),
-        'total_emails': user_status['total_emails'],
-        'sent_count': user_status['sent_count'],
-        'failed_count': user_status['failed_count'],
-        'success_emails': user_status['success_emails'],
-        'failed_emails': user_status['failed_emails'],
+        'total_emails': final_status['total_emails'],
+        'sent_count': final_status['sent_count'],
+        'failed_count': final_status['failed_count'],
+        'results_file': final_status['results_file'],
         'subject': subject,
         'sender_email': sender_email,
         'sender_mode': 'manual',
-        'sender_rotation': user_status['sender_rotation'],
+        'sender_rotation': final_status['sender_rotation'],
         'cc_emails': merged_cc,
         'bcc_emails': merged_bcc,
-        'attachment_name': os.path.basename(attachment_path) if attachment_path else '',
+        'attachment_name': os.path.basename(attachment_path) if attachment is not None else '',
         'account_stats': get_account_stats(user_id)
     }
     
     log_filename = f"bulk_email_log_{user_id}_{end_time.strftime('%Y%m%d_%H%M%S')}.json"
     
-    # Save to file
-    with open(os.path.join(LOGS_FOLDER, log_filename), 'w') as f:
-        json.dump(log_data, f, indent=2)
-    
-    # Save to database
-    save_email_log(user_id, log_data, log_filename)
+    # Save to file and database on the log writer thread
+    log_writer_queue.put((user_id, log_data, log_filename, results_path))
     
-    logger.info(f"Bulk email sending completed from {sender_email} for user {user_id}. {user_status['sent_count']} sent, {user_status['failed_count']} failed. Duration: {duration}")
+    logger.info(f"Bulk email sending completed from {sender_email} for user {user_id}. {final_status['sent_count']} sent, {final_status['failed_count']} failed. Duration: {duration}")
     
     return True, {
-        'success_count': user_status['sent_count'],
-        'failed_count': user_status['failed_count'],
-        'failed_emails': user_status['failed_emails'],
+        'success_count': final_status['sent_count'],
+        'failed_count': final_status['failed_count'],
+        'failed_emails': final_status['failed_emails'],
         'duration': str(duration),
         'log_file': log_filename,
-        'sender_rotation': user_status['sender_rotation']
+        'sender_rotation': final_status['sender_rotation'],
+        'warnings': warnings
     }
\ No newline at end of file